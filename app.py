@@ -1,18 +1,56 @@
 import streamlit as st
-import PyPDF2
-import google.generativeai as genai
 from pathlib import Path
 import os
 from config import GOOGLE_API_KEY
-import fitz  # PyMuPDF for better PDF parsing
-import tempfile
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Dict
 import json
+import hashlib
+import re
+import time
+
+# Built once at import: map control characters leaked by PDF extractors
+# (form feeds, vertical tabs, NULs, ...) to spaces; keep \t, \n, \r
+_CONTROL_CHAR_TABLE = str.maketrans(
+    {c: " " for c in range(32) if c not in (9, 10, 13)}
+)
+_BLANK_RUN_RE = re.compile(r"[ \t]{2,}")
+
+# Gemini regularly fences its JSON in ```json blocks despite "no other
+# text" instructions; these strip the fences and locate the payload
+_JSON_FENCE_RE = re.compile(r"\A```(?:json)?\s*|\s*```\Z")
+_JSON_SPAN_RE = re.compile(r"\[.*\]|\{.*\}", re.DOTALL)
+
+_QA_PROMPT_TEMPLATES = {
+    "factual": "Generate {n} factual questions that test knowledge of specific information from the text.",
+    "conceptual": "Generate {n} conceptual questions that require understanding of main ideas and themes.",
+    "analytical": "Generate {n} analytical questions that require critical thinking and analysis of the content.",
+    "application": "Generate {n} questions that ask how the concepts from the text can be applied to real-world situations."
+}
+
+# Full prompt skeletons built once at import; only {n} and {text} vary per
+# call, which also keeps the prompt text stable for cache keys
+_QA_PROMPTS = {
+    question_type: (
+        "\n    " + template + "\n"
+        '    Respond with only a JSON array of objects with "question" and "answer" keys,\n'
+        "    no other text. Make answers detailed and comprehensive.\n"
+        "\n"
+        "    Text: {text}\n"
+        "    "
+    )
+    for question_type, template in _QA_PROMPT_TEMPLATES.items()
+}
 
 
 
+@st.cache_resource(show_spinner=False)
 def configure_gemini():
-    """Configure the Gemini API with your credentials"""
+    """Configure the Gemini API once per process and keep the model warm"""
+    import google.generativeai as genai  # Deferred: pulls in grpc, slow to import
+
     if not GOOGLE_API_KEY:
         print("Please set your GOOGLE_API_KEY")
         exit()  # Stop execution if API key is not found
@@ -20,124 +58,407 @@ def configure_gemini():
     # Configure Gemini API with the provided key
     genai.configure(api_key=GOOGLE_API_KEY)
 
-    # Return the configured Gemini model
-    return genai.GenerativeModel('gemini-pro')
+    # Generation settings are fixed, so bake them into the model instead of
+    # rebuilding a config object on every generate_content call
+    return genai.GenerativeModel(
+        'gemini-pro',
+        generation_config=genai.GenerationConfig(temperature=0.2)
+    )
 
 
-def extract_text_from_pdf(pdf_file, parser_choice="PyMuPDF"):
-    """Extract text content from uploaded PDF file using selected parser"""
+def _prompt_window(text, limit=5000):
+    """Take the leading window of cleaned text, cut at a paragraph boundary
+
+    Slicing the raw string wastes the budget on extraction noise; cleaning
+    first packs more useful content into the same token allowance.
+    """
+    cleaned = clean_extracted_text(text)
+    if len(cleaned) <= limit:
+        return cleaned
+    window = cleaned[:limit]
+    # Back off to the last paragraph break so the model sees whole paragraphs
+    return window.rsplit("\n\n", 1)[0] or window
+
+
+def _loads_model_json(response_text):
+    """Parse JSON out of a model response, tolerating markdown fences"""
+    cleaned = _JSON_FENCE_RE.sub("", response_text.strip())
     try:
-        if parser_choice == "PyMuPDF":
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(pdf_file.getvalue())
-                tmp_path = tmp_file.name
-
-            # Extract text using PyMuPDF
-            doc = fitz.open(tmp_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            os.unlink(tmp_path)
-            return text
-        else:
-            # Fallback to PyPDF2
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            return text
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {str(e)}")
-        return None
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        # Fall back to the first bracketed span (array or object) in case
+        # the model added prose around the payload
+        match = _JSON_SPAN_RE.search(cleaned)
+        if match:
+            return json.loads(match.group())
+        raise
+
+
+def clean_extracted_text(text):
+    """Normalize extracted text: strip control chars, collapse runs of blanks"""
+    # str.translate and the compiled regex both run in C, one pass each
+    return _BLANK_RUN_RE.sub(" ", text.translate(_CONTROL_CHAR_TABLE))
+
+
+@st.cache_data(show_spinner=False)
+def extract_text_from_bytes(pdf_bytes, parser_choice="PyMuPDF"):
+    """Extract text from raw PDF bytes, cached by content hash across reruns"""
+    text = extract_text_from_pdf(pdf_bytes, parser_choice)
+    return clean_extracted_text(text) if text else text
+
+
+# Pages handed to each extraction worker in one dispatch; blocking keeps a
+# worker's text in cache and cuts per-page executor/lambda overhead
+_PAGE_BLOCK = 64
+
 
+@st.cache_resource(show_spinner=False)
+def _open_fitz_document(pdf_bytes):
+    """Open a fitz.Document once per distinct PDF and share it across reruns
 
-def generate_summary(model, text):
-    """Generate a summary of the text using Gemini API"""
+    MuPDF's open cost (xref parse, font loading) dominates for large PDFs;
+    caching the handle leaves only page-level work on rerun.
+    """
+    import fitz  # PyMuPDF, imported lazily to keep app startup fast
+
+    return fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _extract_page_block(doc, start, stop):
+    """Extract a contiguous block of pages in plain-text mode"""
+    return "".join(doc.load_page(i).get_text("text") for i in range(start, stop))
+
+
+def extract_text_from_pdf(pdf_bytes, parser_choice="PyMuPDF"):
+    """Extract text content from PDF bytes using selected parser
+
+    Returns None for scanned (image-only) PDFs and raises on parse errors;
+    callers report both from the main thread, since Streamlit elements
+    don't render from worker threads.
+    """
+    if parser_choice == "PyMuPDF":
+        # Cached handle; the resource cache owns the document lifetime
+        doc = _open_fitz_document(pdf_bytes)
+
+        # Fast scanned-PDF probe: if the first pages carry no real text,
+        # skip the full traversal and the Gemini calls for this file
+        if not any(
+            len(doc.load_page(i).get_text("text").strip()) > 20
+            for i in range(min(3, doc.page_count))
+        ):
+            return None
+
+        # MuPDF releases the GIL inside get_text(), so page
+        # extraction overlaps across threads for large documents
+        n = doc.page_count
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            parts = list(executor.map(
+                lambda start: _extract_page_block(
+                    doc, start, min(start + _PAGE_BLOCK, n)
+                ),
+                range(0, n, _PAGE_BLOCK)
+            ))
+        return "".join(parts)
+    else:
+        # Fallback to pypdf (maintained successor to PyPDF2)
+        from pypdf import PdfReader
+
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        return "\n".join(
+            page.extract_text() or "" for page in pdf_reader.pages
+        )
+
+
+def generate_summary_stream(model, text):
+    """Yield summary chunks as Gemini produces them, for st.write_stream"""
     prompt = f"""
     Please provide a comprehensive summary of the following text, including:
     1. Main topics and key points
     2. Important findings or conclusions
     3. Notable details or examples
 
-    Text: {text[:5000]}  # Limiting text length to avoid token limits
+    Text: {_prompt_window(text)}
     """
 
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        for chunk in model.generate_content(prompt, stream=True):
+            yield chunk.text
     except Exception as e:
         st.error(f"Error generating summary: {str(e)}")
-        return None
+
+
+@st.cache_data(show_spinner=False)
+def _generate_custom_qa_cached(_model, text, question_type, num_questions):
+    """Success-path Q&A call; raises on failure so errors are never cached"""
+    prompt = _QA_PROMPTS[question_type].format(
+        n=num_questions, text=_prompt_window(text)
+    )
+    response = _model.generate_content(prompt)
+    return _loads_model_json(response.text)
 
 
 def generate_custom_qa(model, text, question_type, num_questions=5):
     """Generate custom questions and answers based on selected type"""
-    prompt_templates = {
-        "factual": "Generate {n} factual questions that test knowledge of specific information from the text.",
-        "conceptual": "Generate {n} conceptual questions that require understanding of main ideas and themes.",
-        "analytical": "Generate {n} analytical questions that require critical thinking and analysis of the content.",
-        "application": "Generate {n} questions that ask how the concepts from the text can be applied to real-world situations."
+    try:
+        return _generate_custom_qa_cached(model, text, question_type, num_questions)
+    except Exception as e:
+        st.error(f"Error generating Q&A: {str(e)}")
+        return None
+
+
+def _build_summary_qa_prompt(text, question_type, num_questions):
+    """Build the fused summary + Q&A prompt shared by single and batch calls"""
+    return f"""
+    Analyze the following text and respond with a single JSON object containing:
+    1. "summary": a comprehensive summary covering main topics, key points,
+       important findings or conclusions, and notable details or examples
+    2. "qa_pairs": a list of {num_questions} {question_type} questions, each a
+       dictionary with 'question' and 'answer' keys. Make answers detailed
+       and comprehensive.
+
+    Respond with only the JSON object, no other text.
+
+    Text: {_prompt_window(text)}
+    """
+
+
+def _parse_summary_qa(response_text):
+    """Parse a fused summary + Q&A JSON response into a result dict"""
+    result = _loads_model_json(response_text)
+    return {
+        "summary": result.get("summary"),
+        "qa_pairs": result.get("qa_pairs")
     }
 
-    prompt = f"""
-    {prompt_templates[question_type].format(n=num_questions)}
-    Format the response as a list of dictionaries with 'question' and 'answer' keys.
-    Make answers detailed and comprehensive.
 
-    Text: {text[:5000]}
+@st.cache_data(show_spinner=False)
+def _generate_summary_and_qa_cached(_model, text, question_type, num_questions):
+    """Success-path fused call; raises on failure so errors are never cached"""
+    response = _model.generate_content(
+        _build_summary_qa_prompt(text, question_type, num_questions)
+    )
+    return _parse_summary_qa(response.text)
+
+
+def _try_batch_generate(prompts):
+    """Submit all prompts as one Gemini Batch API job, one round-trip total
+
+    Batched requests are billed at roughly half the per-token rate. The
+    legacy google-generativeai SDK has no batch endpoint, so this uses the
+    newer google-genai client when it is installed; returns None to signal
+    the caller to fall back to per-file concurrent calls. Per-prompt
+    failures come back as Exception entries so only those get retried.
     """
+    try:
+        from google import genai as genai_client
+    except ImportError:
+        return None
 
     try:
-        response = model.generate_content(prompt)
-        return eval(response.text)  # Note: In production, use safer parsing
+        client = genai_client.Client(api_key=GOOGLE_API_KEY)
+        batch = client.batches.create(
+            model='gemini-pro',
+            src=[
+                {"contents": [{"parts": [{"text": prompt}], "role": "user"}]}
+                for prompt in prompts
+            ]
+        )
+
+        # Poll with exponential backoff until the job settles
+        delay = 2
+        while batch.state.name in ("JOB_STATE_PENDING", "JOB_STATE_RUNNING"):
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+            batch = client.batches.get(name=batch.name)
+
+        if batch.state.name != "JOB_STATE_SUCCEEDED":
+            return None
+
+        responses = []
+        for item in batch.dest.inlined_responses:
+            if getattr(item, "error", None):
+                responses.append(Exception(str(item.error)))
+            else:
+                responses.append(item.response.text)
+        return responses
     except Exception as e:
-        st.error(f"Error generating Q&A: {str(e)}")
+        st.warning(f"Batch API unavailable, using concurrent calls: {str(e)}")
         return None
 
 
-def process_multiple_pdfs(files, model):
-    """Process multiple PDF files and generate combined analysis"""
-    results = []
+def _extract_pypdf_worker(pdf_bytes):
+    """Parse PDF bytes with pypdf; module-level so worker processes can pickle it
 
-    for file in files:
-        text = extract_text_from_pdf(file)
-        if text:
-            summary = generate_summary(model, text)
-            qa_pairs = generate_custom_qa(model, text, "factual", 3)  # Generate 3 questions per file
+    Returns the exception on failure instead of raising: an exception that
+    escapes a process-pool worker aborts the whole executor.map batch.
+    """
+    from pypdf import PdfReader
 
-            results.append({
-                "filename": file.name,
-                "summary": summary,
-                "qa_pairs": qa_pairs
-            })
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        return e
+
+
+def process_multiple_pdfs(files, model, parser_choice="PyMuPDF"):
+    """Process multiple PDF files concurrently and generate combined analysis"""
+
+    # Read each upload's bytes exactly once; getvalue() materializes a
+    # fresh copy of the whole file on every call
+    payloads = [file.getvalue() for file in files]
+
+    # Dedupe identical uploads by content digest so each distinct PDF is
+    # extracted and sent to Gemini once; duplicates share the analysis
+    digests = [
+        hashlib.blake2b(data, digest_size=16).digest()
+        for data in payloads
+    ]
+    unique_data = {}
+    for digest, data in zip(digests, payloads):
+        unique_data.setdefault(digest, data)
+
+    if parser_choice != "PyMuPDF":
+        # pypdf parsing is pure Python and GIL-bound, so threads don't help;
+        # parse files across processes (the returned text is small, IPC is
+        # negligible next to parse cost)
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            raw_texts = executor.map(
+                _extract_pypdf_worker, unique_data.values()
+            )
+        texts = {
+            digest: (
+                text if isinstance(text, Exception)
+                else clean_extracted_text(text)
+            )
+            for digest, text in zip(unique_data, raw_texts)
+        }
+    else:
+        def extract_or_error(data):
+            # Capture failures as values so one bad file doesn't abort the
+            # map and the main thread can report it
+            try:
+                return extract_text_from_bytes(data)
+            except Exception as e:
+                return e
+
+        # PyMuPDF extraction runs outside the GIL, threads suffice
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            raw_texts = executor.map(extract_or_error, unique_data.values())
+        texts = dict(zip(unique_data, raw_texts))
+
+    # Files that failed extraction or yielded no text (e.g. scanned PDFs)
+    # are skipped outright
+    pending = [
+        digest for digest in unique_data
+        if texts.get(digest) and not isinstance(texts[digest], Exception)
+    ]
+
+    # Prefer one Batch API round-trip covering every distinct file; fall
+    # back to the per-file concurrent path when batching is unavailable
+    analyses = {}
+    responses = None
+    if len(pending) > 1:
+        responses = _try_batch_generate([
+            _build_summary_qa_prompt(texts[digest], "factual", 3)  # 3 questions per file
+            for digest in pending
+        ])
+
+    if responses is not None:
+        for digest, response_text in zip(pending, responses):
+            if isinstance(response_text, Exception):
+                # Retry only the failed entries through the per-file path
+                try:
+                    analyses[digest] = _generate_summary_and_qa_cached(
+                        model, texts[digest], "factual", 3
+                    )
+                except Exception as e:
+                    analyses[digest] = e
+            else:
+                try:
+                    analyses[digest] = _parse_summary_qa(response_text)
+                except Exception as e:
+                    analyses[digest] = e
+    else:
+        async def process_one(digest, semaphore):
+            # Bound concurrent Gemini calls to stay under API rate limits.
+            # The cached inner raises on failure, so errors surface through
+            # gather and are reported from the main thread below
+            async with semaphore:
+                return await asyncio.to_thread(
+                    _generate_summary_and_qa_cached,
+                    model, texts[digest], "factual", 3  # 3 questions per file
+                )
+
+        async def process_all():
+            semaphore = asyncio.Semaphore(8)
+            tasks = [process_one(digest, semaphore) for digest in pending]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        analyses = dict(zip(pending, asyncio.run(process_all())))
+
+    results = []
+    for digest, file in zip(digests, files):
+        text = texts.get(digest)
+        if isinstance(text, Exception):
+            st.error(f"Error extracting text from {file.name}: {str(text)}")
+            continue
+        if not text:
+            st.warning(f"{file.name} appears to be scanned (no extractable text) — OCR required")
+            continue
+        analysis = analyses.get(digest)
+        if isinstance(analysis, Exception):
+            st.error(f"Error processing {file.name}: {str(analysis)}")
+        elif analysis:
+            results.append({"filename": file.name, **analysis})
 
     return results
 
 
 def save_analysis_results(results):
-    """Save analysis results as JSON"""
-    return json.dumps(results, indent=2)
+    """Serialize analysis results as JSON for download
+
+    Encodes one result at a time into a bytes buffer rather than building a
+    second full-size string alongside the results list, so peak memory stays
+    ~1x the results for large batches.
+    """
+    try:
+        import orjson  # Rust encoder, ~5-10x faster than stdlib json
+
+        def encode(result):
+            return orjson.dumps(result, option=orjson.OPT_INDENT_2)
+    except ImportError:
+        def encode(result):
+            return json.dumps(result, indent=2).encode()
+
+    if not results:
+        return b"[]"
+
+    buf = io.BytesIO()
+    for i, result in enumerate(results):
+        buf.write(b",\n" if i else b"[\n")
+        buf.write(encode(result))
+    buf.write(b"\n]")
+    return buf.getvalue()
 
 
 def main():
     st.title("Enhanced PDF Analysis with Gemini AI")
     st.write("Upload PDF files for comprehensive analysis and Q&A generation")
 
-    # Initialize Gemini model
-    model = configure_gemini()
-
     # Sidebar for configuration
     st.sidebar.header("Configuration")
     parser_choice = st.sidebar.selectbox(
         "PDF Parser",
-        ["PyMuPDF", "PyPDF2"],
+        ["PyMuPDF", "pypdf"],
         help="PyMuPDF generally provides better results but may be slower"
     )
 
     # Multiple file upload
-    uploaded_files = st.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)
+    uploaded_files = st.file_uploader(
+        "Choose PDF files", type="pdf", accept_multiple_files=True,
+        on_change=_open_fitz_document.clear  # drop handles for stale uploads
+    )
 
     if uploaded_files:
         # Analysis options
@@ -151,7 +472,14 @@ def main():
             selected_file = st.selectbox("Select file to analyze", uploaded_files)
 
             with st.spinner("Processing PDF..."):
-                text = extract_text_from_pdf(selected_file, parser_choice)
+                try:
+                    text = extract_text_from_bytes(selected_file.getvalue(), parser_choice)
+                except Exception as e:
+                    st.error(f"Error extracting text from PDF: {str(e)}")
+                    text = None
+                else:
+                    if not text:
+                        st.warning("PDF appears to be scanned (no extractable text) — OCR required")
 
                 if text:
                     st.success("PDF processed successfully!")
@@ -160,13 +488,10 @@ def main():
                     with st.expander("View extracted text"):
                         st.text(text[:1000] + "..." if len(text) > 1000 else text)
 
-                    # Generate summary
+                    # Generate summary, streamed so rendering overlaps decoding
                     if st.button("Generate Summary"):
-                        with st.spinner("Generating summary..."):
-                            summary = generate_summary(model, text)
-                            if summary:
-                                st.subheader("Document Summary")
-                                st.write(summary)
+                        st.subheader("Document Summary")
+                        st.write_stream(generate_summary_stream(configure_gemini(), text))
 
                     # Q&A Generation
                     st.subheader("Generate Questions & Answers")
@@ -178,7 +503,7 @@ def main():
 
                     if st.button("Generate Q&A"):
                         with st.spinner("Generating questions and answers..."):
-                            qa_pairs = generate_custom_qa(model, text, question_type, num_questions)
+                            qa_pairs = generate_custom_qa(configure_gemini(), text, question_type, num_questions)
 
                             if qa_pairs:
                                 for i, qa in enumerate(qa_pairs, 1):
@@ -201,7 +526,7 @@ def main():
 
             if st.button("Start Batch Analysis"):
                 with st.spinner("Processing files..."):
-                    results = process_multiple_pdfs(uploaded_files, model)
+                    results = process_multiple_pdfs(uploaded_files, configure_gemini(), parser_choice)
 
                     if results:
                         st.success("Batch analysis complete!")